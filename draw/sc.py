@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pyteal import *
 from assets import ticket_price, burn_ticket_price, storage_app_id, oracle_app_id, rewards_pool_address, super_admin_address
 
@@ -79,6 +81,26 @@ err_no_burn_hacking = "ERR NO BURN HACKING"
 
 opup = OpUp(OpUpMode.Explicit, storage_app_id_int)
 
+# measured opcode costs of the drawing path (see the compiled TEAL of get_random_nft_id & exec_draw)
+# budget is checked where the cost is actually incurred instead of guessing up front,
+# so an OpUp inner call only happens when the remaining (pooled) budget can't cover the next step
+# numbers below are measured on the version=6 build (109 and 52 ops) plus a few ops of slack
+# tools/build_report.py measures every budget check and flags any that are too low
+# cost of one draw up to the first odds scan step: free slot lookup, oracle call, mapping & logging the random value
+# the oracle call itself adds 700 to the pooled budget, which more than covers the oracle's own execution
+draw_setup_cost = 115
+# worst case from one odds scan step to the next budget check:
+# either a losing step, or the winning step + storing the NFT ID + next draw / resetting user state
+odds_scan_step_cost = 58
+# worst case from one odds_hash() budget check to the next: the last storage read + sha256 & returning the hash
+# (72 ops measured on the version=6 build, sha256 alone is 35)
+odds_hash_step_cost = 75
+
+# only touch OpUp (and its scratch bookkeeping) when we are actually short on budget
+# the pooled budget includes extra app calls in the group, so callers can pre-pay budget that way
+def ensure_budget(cost):
+    return If(Global.opcode_budget() < cost).Then(opup.ensure_budget(cost))
+
 # my greatest invention
 # assert that fails with an error string attached
 # Example error message: logic eval error: assert failed pc=2330. Details: pc=2330, opcodes=pushbytes 0x45525220445241572051554555454420414c5245414459 // "ERR DRAW QUEUED ALREADY"
@@ -402,12 +424,21 @@ def get_random_bytes(acct, rand_round, cur):
     )
 
 # helper to get int value from storage contract's global storage
-@Subroutine(TealType.uint64)
-def get_ext_storage(keynum):
+# inlined rather than a subroutine - saves the callsub/retsub and scratch shuffling on every odds scan step
+def ext_storage(keynum):
     extvalue = App.globalGetEx(storage_app_id_int, Itob(keynum))
     return Seq(
         extvalue, # must include this or pyteal compilation fails
-        Return(extvalue.value())
+        extvalue.value()
+    )
+
+# map random bytes (ScratchVar) to [0, max_odds)
+# max_odds is a power of 2 (<= 2**63), so the modulo only depends on the last 8 bytes:
+# extract_uint64 + % instead of the 20x more expensive b%
+def rand_mod_max_odds(rand_bytes):
+    return Mod(
+        ExtractUint64(rand_bytes.load(), Minus(Len(rand_bytes.load()), Int(8))),
+        App.globalGet(max_odds_key)
     )
 
 # pick next round as a draw target
@@ -439,15 +470,12 @@ def get_next_rand_round():
 @Subroutine(TealType.uint64)
 def get_random_nft_id(acct, rnd, iter):
     i = ScratchVar(TealType.uint64)
+    rand_bytes = ScratchVar(TealType.bytes)
     rand_val = ScratchVar(TealType.uint64)
     return Seq(
-        # random(256bit) modulo (max_odds) -> to_integer() -> $rand_val
-        rand_val.store(Btoi(
-            BytesMod( # BytesMod is expensive - could have sliced a few bytes off the rnd tail, Btoi and do int mod so save op costs
-                get_random_bytes(acct, rnd, iter), # 256 bit
-                Itob(App.globalGet(max_odds_key)) # Must be power of 2
-            )
-        )),
+        rand_bytes.store(get_random_bytes(acct, rnd, iter)), # 256 bit
+        # random(256bit) modulo (max_odds) -> $rand_val
+        rand_val.store(rand_mod_max_odds(rand_bytes)),
         Log(bytes_rand_mapped), # debug/log label & mapped rand value
         Log(Itob(rand_val.load())),
         # for all possible NFT values
@@ -455,11 +483,13 @@ def get_random_nft_id(acct, rnd, iter):
             Le(i.load(), Int(64)),
             i.store(Add(i.load(), Int(2)))
         ).Do(Seq(
+            # a draw scanning deep into the odds table is the rare expensive path
+            ensure_budget(Int(odds_scan_step_cost)),
             # described in function header doc
-            If (get_ext_storage(i.load()) > rand_val.load()).Then(Seq(
+            If (ext_storage(i.load()) > rand_val.load()).Then(Seq(
                 # switch to using i as results storage
                 # ID to return is one before the odds that just won
-                i.store(get_ext_storage(Minus(i.load(), Int(1)))),
+                i.store(ext_storage(Minus(i.load(), Int(1)))),
                 # assert that the value is not zero
                 fail_if(i.load() == Int(0), err_drawing_failed), # Needed?
                 Return(i.load())
@@ -640,10 +670,11 @@ def exec_draw():
         # if round is not past yet, fail
         fail_if(Lt(Global.round(), App.localGet(Int(1), draw_round_key)), err_wait_for_randomness),
         fail_if(randomness_expired(Int(1)), err_randomness_expired),
-        # auto-inner TXN to storage app to increase budget - triggers when 3x draw
-        opup.ensure_budget(Int(450) * user_draw_amount(Int(1))),
         # for i=0; i<user.draw_amount; i++
         For(i.store(Int(0)), Lt(i.load(), user_draw_amount(Int(1))), i.store(Add(i.load(), Int(1)))).Do(Seq(
+            # auto-inner TXN to storage app to increase budget - only when the pooled budget is short
+            # the odds scan tops up further as needed
+            ensure_budget(Int(draw_setup_cost)),
             App.localPut(
                 Int(1),
                 # get free NFT slot for user
@@ -695,5 +726,27 @@ def refund(*, output: abi.Uint64):
         output.set(amount.load()),
     )
 
-def get_contracts():
-    return router.compile_program(version=6)
+# sha256 over the storage contract's 64 odds table values (8 byte big endian, in key order)
+# compare with the hash printed by tools/odds.py to check the deployed odds table on-chain
+# the storage app must be in the foreign apps array
+# a loop rather than unrolled to keep the program size down, so it needs an OpUp call (or an extra app call in the group)
+@router.method
+def odds_hash(*, output: abi.StaticBytes[Literal[32]]):
+    i = ScratchVar(TealType.uint64)
+    table = ScratchVar(TealType.bytes)
+    return Seq(
+        table.store(bytes_empty),
+        For(i.store(Int(1)),
+            Le(i.load(), Int(64)),
+            i.store(Add(i.load(), Int(1)))
+        ).Do(Seq(
+            ensure_budget(Int(odds_hash_step_cost)),
+            table.store(Concat(table.load(), Itob(ext_storage(i.load())))),
+        )),
+        output.set(Sha256(table.load())),
+    )
+
+# version=6 is the deployed target
+# pyteal's scratch slot optimization drops store/load pairs of single use values, mostly in the odds scan
+def get_contracts(version=6):
+    return router.compile_program(version=version, optimize=OptimizeOptions(scratch_slots=True))
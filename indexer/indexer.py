@@ -0,0 +1,225 @@
+import argparse
+import base64
+import sqlite3
+import time
+
+# Incremental indexer of draw contract local (user) state
+#
+# Consumes the draw app's application call transactions (as returned by the Algorand Indexer)
+# and applies their local-state-delta entries to a materialized per-user table in SQLite.
+# Frontend "your draws" views and the exec_draw backend executors can then query one local table
+# instead of doing one account lookup per user.
+#
+# Resuming: the (round, intra round offset) of the last applied transaction is stored
+# in the same SQLite transaction as the deltas it produced, so a crash never leaves
+# the table and the checkpoint out of sync. On restart we continue from the checkpoint.
+
+draw_app_id = 951618646 # MainNet draw contract
+
+# local (user) storage keys of the draw contract - see draw/sc.py
+local_keys = ('slot1', 'slot2', 'slot3', 'draw_round', 'draw_amount', 'draw_amount_paid')
+# global storage keys the queries depend on - admin updatable, see update_state_int in draw/sc.py
+global_keys = ('max_randomness_range',)
+
+# indexer state delta actions
+delta_set_bytes = 1
+delta_set_uint = 2
+delta_delete = 3
+
+# on-completions after which the user no longer has local state
+on_completion_removes_state = ('closeout', 'clear')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS user_state (
+    address TEXT PRIMARY KEY,
+    slot1 INTEGER NOT NULL DEFAULT 0,
+    slot2 INTEGER NOT NULL DEFAULT 0,
+    slot3 INTEGER NOT NULL DEFAULT 0,
+    draw_round INTEGER NOT NULL DEFAULT 0,
+    draw_amount INTEGER NOT NULL DEFAULT 0,
+    draw_amount_paid INTEGER NOT NULL DEFAULT 0,
+    updated_round INTEGER NOT NULL
+);
+-- keepers: queued draws by randomness round
+CREATE INDEX IF NOT EXISTS user_state_draw_round ON user_state (draw_round) WHERE draw_amount != 0;
+-- frontend/collect: users with uncollected NFTs
+CREATE INDEX IF NOT EXISTS user_state_slot1 ON user_state (slot1) WHERE slot1 != 0;
+CREATE INDEX IF NOT EXISTS user_state_slot2 ON user_state (slot2) WHERE slot2 != 0;
+CREATE INDEX IF NOT EXISTS user_state_slot3 ON user_state (slot3) WHERE slot3 != 0;
+CREATE TABLE IF NOT EXISTS global_state (
+    app_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (app_id, key)
+);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    app_id INTEGER PRIMARY KEY,
+    round INTEGER NOT NULL,
+    intra INTEGER NOT NULL
+);
+'''
+
+def open_db(path):
+    db = sqlite3.connect(path)
+    db.executescript(schema)
+    return db
+
+# last applied (round, intra round offset) or (0, -1) if nothing was applied yet
+def get_checkpoint(db, app_id=draw_app_id):
+    row = db.execute('SELECT round, intra FROM checkpoint WHERE app_id = ?', (app_id,)).fetchone()
+    return row if row is not None else (0, -1)
+
+def set_checkpoint(db, app_id, rnd, intra):
+    db.execute('INSERT OR REPLACE INTO checkpoint (app_id, round, intra) VALUES (?, ?, ?)', (app_id, rnd, intra))
+
+# apply a single indexer delta entry for $address
+def apply_delta(db, address, entry, rnd):
+    key = base64.b64decode(entry['key']).decode('utf-8', 'replace')
+    if key not in local_keys:
+        return
+    action = entry['value']['action']
+    if action == delta_set_uint:
+        value = entry['value'].get('uint', 0)
+    elif action == delta_delete:
+        value = 0
+    else:
+        # draw contract only stores uints locally; ignore anything else
+        return
+    db.execute('INSERT OR IGNORE INTO user_state (address, updated_round) VALUES (?, ?)', (address, rnd))
+    # key is validated against local_keys above, safe to format
+    db.execute(f'UPDATE user_state SET {key} = ?, updated_round = ? WHERE address = ?', (value, rnd, address))
+
+# apply a single indexer global delta entry of $app_id
+def apply_global_delta(db, app_id, entry):
+    key = base64.b64decode(entry['key']).decode('utf-8', 'replace')
+    if key not in global_keys:
+        return
+    action = entry['value']['action']
+    if action == delta_set_uint:
+        db.execute('INSERT OR REPLACE INTO global_state (app_id, key, value) VALUES (?, ?, ?)', (app_id, key, entry['value'].get('uint', 0)))
+    elif action == delta_delete:
+        db.execute('DELETE FROM global_state WHERE app_id = ? AND key = ?', (app_id, key))
+
+# indexed global value of $key, None if never seen
+def get_global(db, key, app_id=draw_app_id):
+    row = db.execute('SELECT value FROM global_state WHERE app_id = ? AND key = ?', (app_id, key)).fetchone()
+    return row[0] if row is not None else None
+
+# apply one indexer transaction (and its inner transactions) to the user table
+def apply_txn(db, txn, app_id=draw_app_id):
+    rnd = txn['confirmed-round']
+    app_txn = txn.get('application-transaction')
+    # the indexer reports the creation with application-id 0 and the new id in created-application-index
+    # it sets the initial global state (see handle_creation in draw/sc.py)
+    if app_txn is not None and app_id in (app_txn['application-id'], txn.get('created-application-index')):
+        for entry in txn.get('global-state-delta', []):
+            apply_global_delta(db, app_id, entry)
+        for account_delta in txn.get('local-state-delta', []):
+            for entry in account_delta['delta']:
+                apply_delta(db, account_delta['address'], entry, rnd)
+        # close-out and clear-state wipe the user's local state entirely
+        if app_txn['on-completion'] in on_completion_removes_state:
+            db.execute('DELETE FROM user_state WHERE address = ?', (txn['sender'],))
+    for inner in txn.get('inner-txns', []):
+        # inner txns don't carry their own confirmed-round
+        inner.setdefault('confirmed-round', rnd)
+        apply_txn(db, inner, app_id)
+
+# apply a page of transactions; skips anything at or before the checkpoint
+# returns the number of transactions applied
+def apply_txns(db, txns, app_id=draw_app_id):
+    checkpoint = get_checkpoint(db, app_id)
+    applied = 0
+    with db:
+        for txn in sorted(txns, key=lambda t: (t['confirmed-round'], t['intra-round-offset'])):
+            position = (txn['confirmed-round'], txn['intra-round-offset'])
+            if position <= checkpoint:
+                continue
+            apply_txn(db, txn, app_id)
+            set_checkpoint(db, app_id, *position)
+            checkpoint = position
+            applied += 1
+    return applied
+
+# pull all new app call transactions from the indexer and apply them
+# returns the number of transactions applied
+def sync(db, indexer_client, app_id=draw_app_id, page_size=1000):
+    rnd, _ = get_checkpoint(db, app_id)
+    applied = 0
+    next_page = None
+    while True:
+        res = indexer_client.search_transactions(
+            application_id=app_id,
+            min_round=rnd, # inclusive: the checkpoint round may have been partially applied
+            limit=page_size,
+            next_page=next_page,
+        )
+        applied += apply_txns(db, res.get('transactions', []), app_id)
+        next_page = res.get('next-token')
+        if not next_page or not res.get('transactions'):
+            return applied
+
+# Queries
+
+# the draw contract's current max_randomness_range: draws older than this can only be refunded (see draw/sc.py)
+# taken from the indexed global state unless given
+def randomness_range(db, max_randomness_range=None, app_id=draw_app_id):
+    if max_randomness_range is not None:
+        return max_randomness_range
+    value = get_global(db, 'max_randomness_range', app_id)
+    if value is None:
+        raise ValueError(f'max_randomness_range of app {app_id} not indexed yet, sync from its creation or pass it explicitly')
+    return value
+
+# users with a queued draw whose randomness round has passed - for exec_draw backends
+def draws_ready(db, current_round, max_randomness_range=None, app_id=draw_app_id):
+    max_randomness_range = randomness_range(db, max_randomness_range, app_id)
+    return db.execute(
+        'SELECT address, draw_round, draw_amount FROM user_state '
+        'WHERE draw_amount != 0 AND draw_round <= ? AND draw_round + ? >= ? ORDER BY draw_round',
+        (current_round, max_randomness_range, current_round)
+    ).fetchall()
+
+# users with an expired draw - refundable
+def draws_expired(db, current_round, max_randomness_range=None, app_id=draw_app_id):
+    max_randomness_range = randomness_range(db, max_randomness_range, app_id)
+    return db.execute(
+        'SELECT address, draw_round, draw_amount_paid FROM user_state '
+        'WHERE draw_amount != 0 AND draw_round + ? < ? ORDER BY draw_round',
+        (max_randomness_range, current_round)
+    ).fetchall()
+
+# a user's full local state as a dict, None if not opted in (or not seen yet)
+def user_state(db, address):
+    row = db.execute(
+        'SELECT ' + ', '.join(local_keys) + ' FROM user_state WHERE address = ?', (address,)
+    ).fetchone()
+    return dict(zip(local_keys, row)) if row is not None else None
+
+# users with uncollected NFTs
+def users_with_nfts(db):
+    return [row[0] for row in db.execute(
+        'SELECT address FROM user_state WHERE slot1 != 0 '
+        'UNION SELECT address FROM user_state WHERE slot2 != 0 '
+        'UNION SELECT address FROM user_state WHERE slot3 != 0'
+    )]
+
+if __name__ == '__main__':
+    from algosdk.v2client.indexer import IndexerClient
+
+    parser = argparse.ArgumentParser(description='Index CupStakes draw contract user state into SQLite')
+    parser.add_argument('--db', default='draw_state.sqlite')
+    parser.add_argument('--app-id', type=int, default=draw_app_id)
+    parser.add_argument('--indexer', default='https://mainnet-idx.algonode.cloud')
+    parser.add_argument('--token', default='')
+    parser.add_argument('--follow', type=int, metavar='SECONDS', help='keep polling every SECONDS')
+    args = parser.parse_args()
+
+    db = open_db(args.db)
+    client = IndexerClient(args.token, args.indexer)
+    while True:
+        applied = sync(db, client, args.app_id)
+        print(f'applied {applied} txns, checkpoint {get_checkpoint(db, args.app_id)}')
+        if not args.follow:
+            break
+        time.sleep(args.follow)
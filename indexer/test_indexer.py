@@ -0,0 +1,112 @@
+import base64
+
+import pytest
+
+import indexer
+
+app_id = indexer.draw_app_id
+alice = 'ALICE'
+bob = 'BOB'
+
+def b64(text):
+    return base64.b64encode(text.encode()).decode()
+
+def set_uint(key, value):
+    return {'key': b64(key), 'value': {'action': indexer.delta_set_uint, 'uint': value}}
+
+# synthetic indexer app call transaction
+def app_call(rnd, intra, sender, on_completion='noop', local=None, global_delta=None, inner=(), app=app_id):
+    txn = {
+        'confirmed-round': rnd,
+        'intra-round-offset': intra,
+        'sender': sender,
+        'application-transaction': {'application-id': app, 'on-completion': on_completion},
+        'local-state-delta': [{'address': address, 'delta': delta} for address, delta in (local or {}).items()],
+        'global-state-delta': global_delta or [],
+    }
+    if inner:
+        txn['inner-txns'] = list(inner)
+    return txn
+
+@pytest.fixture
+def db():
+    return indexer.open_db(':memory:')
+
+def test_apply_txns_in_order(db):
+    txns = [
+        app_call(10, 1, alice, local={alice: [set_uint('draw_amount', 0)]}),
+        app_call(10, 0, alice, local={alice: [set_uint('draw_amount', 3), set_uint('draw_round', 16)]}),
+    ]
+    assert indexer.apply_txns(db, txns) == 2
+    state = indexer.user_state(db, alice)
+    assert state['draw_amount'] == 0
+    assert state['draw_round'] == 16
+    assert indexer.get_checkpoint(db) == (10, 1)
+
+def test_ignores_other_apps_and_unknown_keys(db):
+    txns = [
+        app_call(10, 0, alice, local={alice: [set_uint('slot1', 5)]}, app=app_id + 1),
+        app_call(10, 1, bob, local={bob: [set_uint('unknown', 5), {'key': b64('slot1'), 'value': {'action': indexer.delta_set_bytes, 'bytes': ''}}]}),
+    ]
+    indexer.apply_txns(db, txns)
+    assert indexer.user_state(db, alice) is None
+    assert indexer.user_state(db, bob) is None
+
+def test_checkpoint_resume_skips_applied(db):
+    first = app_call(10, 0, alice, local={alice: [set_uint('slot1', 5)]})
+    second = app_call(11, 0, alice, local={alice: [set_uint('slot1', 0), set_uint('slot2', 6)]})
+    assert indexer.apply_txns(db, [first]) == 1
+    # sync re-requests the checkpoint round: already applied transactions must not be replayed
+    assert indexer.apply_txns(db, [first, second]) == 1
+    assert indexer.apply_txns(db, [first, second]) == 0
+    state = indexer.user_state(db, alice)
+    assert (state['slot1'], state['slot2']) == (0, 6)
+    assert indexer.get_checkpoint(db) == (11, 0)
+
+def test_checkpoint_survives_reopen(tmp_path):
+    path = str(tmp_path / 'state.sqlite')
+    db = indexer.open_db(path)
+    indexer.apply_txns(db, [app_call(10, 2, alice, local={alice: [set_uint('slot3', 7)]})])
+    db.close()
+    db = indexer.open_db(path)
+    assert indexer.get_checkpoint(db) == (10, 2)
+    assert indexer.user_state(db, alice)['slot3'] == 7
+
+@pytest.mark.parametrize('on_completion', ['closeout', 'clear'])
+def test_closeout_and_clear_remove_user(db, on_completion):
+    indexer.apply_txns(db, [
+        app_call(10, 0, alice, local={alice: [set_uint('slot1', 5)]}),
+        app_call(10, 0, bob, local={bob: [set_uint('slot1', 6)]}) | {'intra-round-offset': 1},
+        app_call(11, 0, alice, on_completion=on_completion),
+    ])
+    assert indexer.user_state(db, alice) is None
+    assert indexer.users_with_nfts(db) == [bob]
+
+def test_inner_txns_use_outer_round(db):
+    inner = app_call(None, None, 'APP', local={alice: [set_uint('draw_amount', 1)]})
+    del inner['confirmed-round'], inner['intra-round-offset']
+    indexer.apply_txns(db, [app_call(12, 0, bob, app=app_id + 1, inner=[inner])])
+    assert indexer.user_state(db, alice)['draw_amount'] == 1
+
+# the indexer reports app creations with application-id 0 and the new id in created-application-index
+def app_create(rnd, intra, sender, global_delta):
+    txn = app_call(rnd, intra, sender, global_delta=global_delta, app=0)
+    txn['created-application-index'] = app_id
+    return txn
+
+def test_draw_queries_use_indexed_randomness_range(db):
+    indexer.apply_txns(db, [
+        app_create(1, 0, 'CREATOR', global_delta=[set_uint('max_randomness_range', 1000)]),
+        app_call(10, 0, alice, local={alice: [set_uint('draw_amount', 1), set_uint('draw_round', 16)]}),
+    ])
+    assert [r[0] for r in indexer.draws_ready(db, 1016)] == [alice]
+    assert indexer.draws_expired(db, 1017) == [(alice, 16, 0)]
+    # admin shortens the range
+    indexer.apply_txns(db, [app_call(20, 0, 'CREATOR', global_delta=[set_uint('max_randomness_range', 100)])])
+    assert indexer.draws_ready(db, 1016) == []
+    assert [r[0] for r in indexer.draws_expired(db, 1016)] == [alice]
+    assert [r[0] for r in indexer.draws_ready(db, 1016, max_randomness_range=1000)] == [alice]
+
+def test_draw_queries_need_randomness_range(db):
+    with pytest.raises(ValueError):
+        indexer.draws_ready(db, 1016)
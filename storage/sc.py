@@ -56,5 +56,6 @@ def update_state_int(key1: abi.DynamicBytes, val1: abi.Uint64,
         If(key8.get() != bytes_empty).Then(App.globalPut(key8.get(), val8.get())),
     )
 
-def get_contracts():
-    return router.compile_program(version=7)
+# version=7 is the deployed target
+def get_contracts(version=7):
+    return router.compile_program(version=version)
@@ -0,0 +1,616 @@
+import base64
+import hashlib
+
+from algosdk import encoding, logic
+
+# Minimal model of the AVM, covering the opcodes our contracts compile to
+# Used to measure per-method opcode cost and to compare the behaviour of different builds
+# of the same contract (see build_report.py). Not a full AVM: no signature checks,
+# no asset/algo balances, no fees, inner app calls are handled by python callbacks.
+
+# opcode costs that are not 1
+op_costs = {
+    'b%': 20, 'b*': 20, 'b/': 20, 'b+': 10, 'b-': 10,
+    'sha256': 35, 'sha512_256': 45, 'keccak256': 130, 'sha3_256': 130,
+    'ed25519verify': 1900,
+}
+
+# budget added to the group's pool by every (inner) app call
+app_call_budget = 700
+
+# named int constants
+int_constants = {
+    # TypeEnum
+    'unknown': 0, 'pay': 1, 'keyreg': 2, 'acfg': 3, 'axfer': 4, 'afrz': 5, 'appl': 6,
+    # OnCompletion
+    'NoOp': 0, 'OptIn': 1, 'CloseOut': 2, 'ClearState': 3, 'UpdateApplication': 4, 'DeleteApplication': 5,
+}
+
+# immediate sizes in bytes of assembled opcodes, all others have none
+# branches are 2 byte offsets; pushint/pushbytes/cblocks are variable and handled separately
+immediate_sizes = {
+    'b': 2, 'bz': 2, 'bnz': 2, 'callsub': 2,
+    'load': 1, 'store': 1, 'txn': 1, 'global': 1, 'txnas': 1, 'gtxns': 1, 'gtxnsas': 1, 'gtxnas': 2,
+    'itxn': 1, 'itxn_field': 1, 'itxnas': 1, 'arg': 1, 'dig': 1, 'cover': 1, 'uncover': 1,
+    'intc': 1, 'bytec': 1, 'app_params_get': 1, 'asset_holding_get': 1, 'asset_params_get': 1,
+    'acct_params_get': 1, 'replace2': 1, 'base64_decode': 1, 'json_ref': 1, 'vrf_verify': 1,
+    'block': 1, 'frame_dig': 1, 'frame_bury': 1, 'bury': 1, 'popn': 1, 'dupn': 1, 'gloads': 1,
+    'txna': 2, 'gtxn': 2, 'itxna': 2, 'gtxnsa': 2, 'gload': 2, 'substring': 2, 'extract': 2, 'proto': 2,
+    'gtxna': 3,
+}
+
+class AVMError(Exception):
+    pass
+
+# split a TEAL line into tokens, keeping quoted strings whole and dropping comments
+def tokenize(line):
+    tokens = []
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c.isspace():
+            i += 1
+        elif line.startswith('//', i):
+            break
+        elif c == '"':
+            j = i + 1
+            while line[j] != '"':
+                j += 2 if line[j] == '\\' else 1
+            tokens.append(line[i:j + 1])
+            i = j + 1
+        else:
+            j = i
+            while j < len(line) and not line[j].isspace():
+                j += 1
+            tokens.append(line[i:j])
+            i = j
+    return tokens
+
+def parse_string(token):
+    body = token[1:-1]
+    return body.encode('latin-1').decode('unicode_escape').encode('latin-1')
+
+# decode a byte constant: "string", 0xhex, base64 ..., b64 ...
+def parse_bytes(args):
+    if args[0].startswith('"'):
+        return parse_string(args[0])
+    if args[0].startswith('0x'):
+        return bytes.fromhex(args[0][2:])
+    if args[0] in ('base64', 'b64'):
+        return base64.b64decode(args[1])
+    if args[0] in ('base16', 'b16'):
+        return bytes.fromhex(args[1])
+    raise AVMError(f'unsupported byte constant {args}')
+
+def parse_int(arg):
+    if arg in int_constants:
+        return int_constants[arg]
+    return int(arg, 0)
+
+def method_selector(signature):
+    return hashlib.new('sha512_256', signature.encode()).digest()[:4]
+
+# resolve pseudo-op constants to (kind, value): ('int', n) or ('bytes', b), None otherwise
+def constant_of(op, args):
+    if op == 'int':
+        return ('int', parse_int(args[0]))
+    if op == 'byte':
+        return ('bytes', parse_bytes(args))
+    if op == 'addr':
+        return ('bytes', encoding.decode_address(args[0]))
+    if op == 'method':
+        return ('bytes', method_selector(parse_string(args[0]).decode()))
+    return None
+
+class Program:
+    def __init__(self, teal):
+        self.version = 1
+        self.ops = [] # (op, args)
+        self.labels = {}
+        for line in teal.splitlines():
+            tokens = tokenize(line)
+            if not tokens:
+                continue
+            if tokens[0] == '#pragma':
+                self.version = int(tokens[2])
+            elif len(tokens) == 1 and tokens[0].endswith(':'):
+                self.labels[tokens[0][:-1]] = len(self.ops)
+            else:
+                self.ops.append((tokens[0], tokens[1:]))
+
+    def op_count(self):
+        return len(self.ops)
+
+def uvarint_size(n):
+    size = 1
+    while n >= 0x80:
+        n >>= 7
+        size += 1
+    return size
+
+# estimated size in bytes of the assembled program
+# mirrors goal's assembler: int/byte pseudo-ops referenced more than once are moved into
+# intcblock/bytecblock (most frequent first, the first 4 get 1 byte intc_N/bytec_N ops),
+# single use constants become pushint/pushbytes
+# exact sizes need `goal clerk compile` / algod's compile endpoint
+def assembled_size(teal):
+    program = Program(teal)
+    size = uvarint_size(program.version)
+    freq = {}
+    for op, args in program.ops:
+        const = constant_of(op, args)
+        if const is not None:
+            freq[const] = freq.get(const, 0) + 1
+    has_cblocks = any(op in ('intcblock', 'bytecblock') for op, _ in program.ops)
+    block = {}
+    if not has_cblocks:
+        for kind in ('int', 'bytes'):
+            consts = sorted((c for c in freq if c[0] == kind and freq[c] > 1), key=lambda c: -freq[c])
+            if consts:
+                size += 1 + uvarint_size(len(consts))
+            for idx, c in enumerate(consts):
+                block[c] = idx
+                size += uvarint_size(c[1]) if kind == 'int' else uvarint_size(len(c[1])) + len(c[1])
+    for op, args in program.ops:
+        const = constant_of(op, args)
+        if const is not None:
+            if const in block:
+                size += 1 if block[const] < 4 else 2
+            elif const[0] == 'int':
+                size += 1 + uvarint_size(const[1])
+            else:
+                size += 1 + uvarint_size(len(const[1])) + len(const[1])
+        elif op == 'intcblock':
+            size += 1 + uvarint_size(len(args)) + sum(uvarint_size(parse_int(a)) for a in args)
+        elif op == 'bytecblock':
+            values = [parse_bytes([a]) for a in args]
+            size += 1 + uvarint_size(len(values)) + sum(uvarint_size(len(v)) + len(v) for v in values)
+        elif op == 'pushint':
+            size += 1 + uvarint_size(parse_int(args[0]))
+        elif op == 'pushbytes':
+            value = parse_bytes(args)
+            size += 1 + uvarint_size(len(value)) + len(value)
+        else:
+            size += 1 + immediate_sizes.get(op, 0)
+    return size
+
+def address_bytes(address):
+    return encoding.decode_address(address) if isinstance(address, str) else address
+
+def itob(n):
+    return n.to_bytes(8, 'big')
+
+class Budget:
+    def __init__(self, app_calls=1):
+        self.pool = app_calls * app_call_budget
+        self.used = 0
+
+    def remaining(self):
+        return self.pool - self.used
+
+    def spend(self, cost):
+        self.used += cost
+        if self.used > self.pool:
+            raise AVMError('dynamic cost budget exceeded')
+
+# global & local state of apps
+# apps: app_id -> {'creator': bytes, 'global': {key: value}}
+# locals: (address bytes, app_id) -> {key: value}
+# handlers: app_id -> fn(ledger, itxn fields, budget) -> list of logs, for inner app calls
+class Ledger:
+    def __init__(self, round=1000):
+        self.round = round
+        self.apps = {}
+        self.locals = {}
+        self.handlers = {}
+
+    def create_app(self, app_id, creator, global_state=None):
+        self.apps[app_id] = {'creator': address_bytes(creator), 'global': dict(global_state or {})}
+
+    def opt_in(self, address, app_id, local_state=None):
+        self.locals[(address_bytes(address), app_id)] = dict(local_state or {})
+
+    def snapshot(self):
+        return (
+            {app_id: dict(app['global']) for app_id, app in self.apps.items()},
+            {k: dict(v) for k, v in self.locals.items()},
+        )
+
+    def restore(self, snapshot):
+        globals_, locals_ = snapshot
+        for app_id, state in globals_.items():
+            self.apps[app_id]['global'] = state
+        self.locals = locals_
+
+class Result:
+    def __init__(self, approved, cost, logs, inner_txns, error=None, error_hint=None, budget_checks=()):
+        self.approved = approved
+        self.cost = cost
+        self.logs = logs
+        self.inner_txns = inner_txns
+        self.error = error
+        # last byte constant pushed before failing - our custom_assert error strings
+        self.error_hint = error_hint
+        # (checked cost, ops actually run until the next check) - see Eval.budget_read
+        self.budget_checks = list(budget_checks)
+
+    def __repr__(self):
+        if self.approved:
+            return f'<approved cost={self.cost} logs={len(self.logs)} inner={len(self.inner_txns)}>'
+        return f'<rejected cost={self.cost} error={self.error!r} hint={self.error_hint!r}>'
+
+# execution of one app call
+# txn: dict of txn fields, arrays (ApplicationArgs, Accounts, Assets, Applications) as lists
+# group: list of txn dicts, txn included
+class Eval:
+    def __init__(self, program, ledger, app_id, txn, group, budget):
+        self.program = program
+        self.ledger = ledger
+        self.app_id = app_id
+        self.txn = txn
+        self.group = group
+        self.budget = budget
+        self.stack = []
+        self.scratch = [0] * 256
+        self.callstack = []
+        self.pc = 0
+        self.cost = 0
+        self.logs = []
+        self.inner_txns = []
+        self.itxn = None
+        self.last_itxn = None
+        self.intc = []
+        self.bytec = []
+        self.last_bytes = None
+        self.budget_checks = []
+        self.open_check = None
+
+    def pop(self, kind=None):
+        if not self.stack:
+            raise AVMError('stack underflow')
+        value = self.stack.pop()
+        if kind is int and not isinstance(value, int):
+            raise AVMError('expected uint64')
+        if kind is bytes and not isinstance(value, bytes):
+            raise AVMError('expected bytes')
+        return value
+
+    def push(self, value):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int) and not 0 <= value < 2**64:
+            raise AVMError('uint64 overflow')
+        if isinstance(value, bytes):
+            if len(value) > 4096:
+                raise AVMError('byte array too long')
+            self.last_bytes = value
+        self.stack.append(value)
+
+    def txn_field(self, txn, field, index=None):
+        if field == 'ApplicationArgs':
+            return txn.get('ApplicationArgs', [])[index]
+        if field == 'Accounts':
+            return address_bytes(txn['Sender']) if index == 0 else address_bytes(txn['Accounts'][index - 1])
+        if field == 'Assets':
+            return txn['Assets'][index]
+        if field == 'Applications':
+            return self.app_id if index == 0 else txn['Applications'][index - 1]
+        if field == 'NumAppArgs':
+            return len(txn.get('ApplicationArgs', []))
+        if field == 'NumAccounts':
+            return len(txn.get('Accounts', []))
+        if field == 'NumAssets':
+            return len(txn.get('Assets', []))
+        if field == 'NumApplications':
+            return len(txn.get('Applications', []))
+        if field == 'GroupIndex':
+            return next(i for i, t in enumerate(self.group) if t is txn)
+        if field in ('Sender', 'Receiver', 'AssetReceiver', 'CloseRemainderTo', 'AssetCloseTo', 'RekeyTo'):
+            return address_bytes(txn[field]) if field in txn else bytes(32)
+        if field == 'ApplicationID' and txn is self.txn:
+            return txn.get('ApplicationID', self.app_id)
+        if field == 'TypeEnum':
+            value = txn.get('TypeEnum', 0)
+            return int_constants[value] if isinstance(value, str) else value
+        return txn.get(field, 0)
+
+    def global_field(self, field):
+        if field == 'CreatorAddress':
+            return self.ledger.apps[self.app_id]['creator']
+        if field == 'CurrentApplicationAddress':
+            return encoding.decode_address(logic.get_application_address(self.app_id))
+        if field == 'CurrentApplicationID':
+            return self.app_id
+        if field == 'OpcodeBudget':
+            return self.budget.remaining()
+        if field == 'Round':
+            return self.ledger.round
+        if field == 'GroupSize':
+            return len(self.group)
+        if field == 'ZeroAddress':
+            return bytes(32)
+        if field == 'MinTxnFee':
+            return 1000
+        if field == 'LatestTimestamp':
+            return 0
+        raise AVMError(f'unsupported global {field}')
+
+    def local_state(self, account):
+        if isinstance(account, int):
+            account = self.txn_field(self.txn, 'Accounts', account)
+        key = (account, self.app_id)
+        if key not in self.ledger.locals:
+            raise AVMError('account not opted in')
+        return self.ledger.locals[key]
+
+    # app reference of app_global_get_ex & co: an index into Applications (0 is this app)
+    # or an app ID, which must be this app or in the foreign apps array
+    def foreign_app(self, app):
+        apps = self.txn.get('Applications', [])
+        if app <= len(apps):
+            return self.txn_field(self.txn, 'Applications', app)
+        if app != self.app_id and app not in apps:
+            raise AVMError(f'unavailable App {app}')
+        return app
+
+    # budget checks are `global OpcodeBudget; int C; <` (see ensure_budget in draw/sc.py):
+    # they promise the program can run C ops from there until the next check
+    # ops are counted from the check, or from the OpUp loop's last budget read when it was short;
+    # inner app calls in between count as free, they add their own 700
+    def budget_read(self):
+        ops = self.program.ops
+        following = [ops[i] for i in range(self.pc, min(self.pc + 2, len(ops)))]
+        const = constant_of(*following[0]) if following else None
+        is_check = const is not None and const[0] == 'int' and len(following) == 2 and following[1][0] == '<'
+        if is_check:
+            self.close_check()
+            self.open_check = [const[1], self.cost, self.budget.remaining() < const[1]]
+        elif self.open_check is not None and self.open_check[2]:
+            self.open_check[1] = self.cost
+
+    def close_check(self):
+        if self.open_check is not None:
+            self.budget_checks.append((self.open_check[0], self.cost - self.open_check[1]))
+            self.open_check = None
+
+    def submit_itxn(self):
+        itxn = self.itxn
+        self.itxn = None
+        itxn['Logs'] = []
+        if itxn.get('TypeEnum') == int_constants['appl']:
+            # inner app calls can only target apps of the foreign apps array
+            if itxn.get('ApplicationID', 0) not in self.txn.get('Applications', []):
+                raise AVMError(f'unavailable App {itxn.get("ApplicationID", 0)}')
+            self.budget.pool += app_call_budget
+            handler = self.ledger.handlers.get(itxn.get('ApplicationID'))
+            if handler is not None:
+                itxn['Logs'] = handler(self.ledger, itxn, self.budget)
+        self.inner_txns.append(itxn)
+        self.last_itxn = itxn
+
+    def run(self):
+        ops = self.program.ops
+        while True:
+            if self.pc >= len(ops):
+                if len(self.stack) != 1:
+                    raise AVMError('stack must have exactly one value at end of program')
+                self.close_check()
+                return self.pop()
+            op, args = ops[self.pc]
+            cost = op_costs.get(op, 1)
+            self.cost += cost
+            self.budget.spend(cost)
+            self.pc += 1
+            result = self.step(op, args)
+            if op == 'global' and args[0] == 'OpcodeBudget':
+                self.budget_read()
+            if result is not None:
+                self.close_check()
+                return result
+
+    # execute one op; returns the program's final value on `return`
+    def step(self, op, args):
+        const = constant_of(op, args)
+        if const is not None:
+            self.push(const[1])
+        elif op in ('intcblock', 'bytecblock'):
+            if op == 'intcblock':
+                self.intc = [parse_int(a) for a in args]
+            else:
+                self.bytec = [parse_bytes([a]) for a in args]
+        elif op.startswith('intc'):
+            self.push(self.intc[int(op[5:]) if op != 'intc' else int(args[0])])
+        elif op.startswith('bytec'):
+            self.push(self.bytec[int(op[6:]) if op != 'bytec' else int(args[0])])
+        elif op == 'pushint':
+            self.push(parse_int(args[0]))
+        elif op == 'pushbytes':
+            self.push(parse_bytes(args))
+        elif op == 'load':
+            self.push(self.scratch[int(args[0])])
+        elif op == 'store':
+            self.scratch[int(args[0])] = self.pop()
+        elif op == 'loads':
+            self.push(self.scratch[self.pop(int)])
+        elif op == 'stores':
+            value = self.pop()
+            self.scratch[self.pop(int)] = value
+        elif op == 'b':
+            self.pc = self.program.labels[args[0]]
+        elif op in ('bz', 'bnz'):
+            if (self.pop(int) != 0) == (op == 'bnz'):
+                self.pc = self.program.labels[args[0]]
+        elif op == 'callsub':
+            self.callstack.append(self.pc)
+            self.pc = self.program.labels[args[0]]
+        elif op == 'retsub':
+            self.pc = self.callstack.pop()
+        elif op == 'return':
+            return self.pop()
+        elif op == 'err':
+            raise AVMError('err opcode executed')
+        elif op == 'assert':
+            if self.pop(int) == 0:
+                raise AVMError('assert failed')
+        elif op in ('==', '!='):
+            b, a = self.pop(), self.pop()
+            if type(a) != type(b):
+                raise AVMError(f'{op} type mismatch')
+            self.push((a == b) == (op == '=='))
+        elif op in ('<', '>', '<=', '>=', '&&', '||', '+', '-', '*', '/', '%', '&', '|', '^'):
+            b, a = self.pop(int), self.pop(int)
+            if op in ('/', '%') and b == 0:
+                raise AVMError(f'{op} by zero')
+            self.push({
+                '<': lambda: a < b, '>': lambda: a > b, '<=': lambda: a <= b, '>=': lambda: a >= b,
+                '&&': lambda: a != 0 and b != 0, '||': lambda: a != 0 or b != 0,
+                '+': lambda: a + b, '-': lambda: a - b, '*': lambda: a * b,
+                '/': lambda: a // b, '%': lambda: a % b, '&': lambda: a & b, '|': lambda: a | b, '^': lambda: a ^ b,
+            }[op]())
+        elif op == '!':
+            self.push(self.pop(int) == 0)
+        elif op == 'b%':
+            b, a = self.pop(bytes), self.pop(bytes)
+            if int.from_bytes(b, 'big') == 0:
+                raise AVMError('b% by zero')
+            value = int.from_bytes(a, 'big') % int.from_bytes(b, 'big')
+            self.push(value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big') if value else b'')
+        elif op in ('sha256', 'sha512_256', 'sha3_256'):
+            self.push(hashlib.new(op, self.pop(bytes)).digest())
+        elif op == 'itob':
+            self.push(itob(self.pop(int)))
+        elif op == 'btoi':
+            value = self.pop(bytes)
+            if len(value) > 8:
+                raise AVMError('btoi arg too long')
+            self.push(int.from_bytes(value, 'big'))
+        elif op == 'len':
+            self.push(len(self.pop(bytes)))
+        elif op == 'concat':
+            b, a = self.pop(bytes), self.pop(bytes)
+            self.push(a + b)
+        elif op in ('substring', 'substring3', 'extract', 'extract3'):
+            if op in ('substring', 'extract'):
+                start, second = int(args[0]), int(args[1])
+            else:
+                second, start = self.pop(int), self.pop(int)
+            value = self.pop(bytes)
+            end = second if op.startswith('substring') else (len(value) if op == 'extract' and second == 0 else start + second)
+            if start > len(value) or end > len(value) or end < start:
+                raise AVMError(f'{op} out of range')
+            self.push(value[start:end])
+        elif op in ('extract_uint16', 'extract_uint32', 'extract_uint64'):
+            size = int(op[len('extract_uint'):]) // 8
+            start = self.pop(int)
+            value = self.pop(bytes)
+            if start + size > len(value):
+                raise AVMError(f'{op} out of range')
+            self.push(int.from_bytes(value[start:start + size], 'big'))
+        elif op == 'pop':
+            self.pop()
+        elif op == 'dup':
+            value = self.pop()
+            self.stack += [value, value]
+        elif op == 'dup2':
+            b, a = self.pop(), self.pop()
+            self.stack += [a, b, a, b]
+        elif op == 'swap':
+            b, a = self.pop(), self.pop()
+            self.stack += [b, a]
+        elif op == 'dig':
+            self.push(self.stack[-1 - int(args[0])])
+        elif op == 'cover':
+            self.stack.insert(len(self.stack) - 1 - int(args[0]), self.stack.pop())
+        elif op == 'uncover':
+            self.stack.append(self.stack.pop(-1 - int(args[0])))
+        elif op == 'select':
+            cond, b, a = self.pop(int), self.pop(), self.pop()
+            self.push(b if cond else a)
+        elif op == 'log':
+            self.logs.append(self.pop(bytes))
+        elif op == 'txn':
+            self.push(self.txn_field(self.txn, args[0]))
+        elif op == 'txna':
+            self.push(self.txn_field(self.txn, args[0], int(args[1])))
+        elif op == 'txnas':
+            self.push(self.txn_field(self.txn, args[0], self.pop(int)))
+        elif op == 'gtxn':
+            self.push(self.txn_field(self.group[int(args[0])], args[1]))
+        elif op == 'gtxna':
+            self.push(self.txn_field(self.group[int(args[0])], args[1], int(args[2])))
+        elif op == 'gtxns':
+            self.push(self.txn_field(self.group[self.pop(int)], args[0]))
+        elif op == 'global':
+            self.push(self.global_field(args[0]))
+        elif op == 'itxn_begin':
+            self.itxn = {}
+        elif op == 'itxn_field':
+            value = self.pop()
+            if args[0] in ('ApplicationArgs', 'Accounts', 'Assets', 'Applications'):
+                self.itxn.setdefault(args[0], []).append(value)
+            else:
+                self.itxn[args[0]] = value
+        elif op == 'itxn_submit':
+            self.submit_itxn()
+        elif op == 'itxn':
+            if args[0] == 'LastLog':
+                logs = self.last_itxn['Logs']
+                self.push(logs[-1] if logs else b'')
+            elif args[0] == 'NumLogs':
+                self.push(len(self.last_itxn['Logs']))
+            else:
+                self.push(self.last_itxn.get(args[0], 0))
+        elif op == 'app_global_get':
+            self.push(self.ledger.apps[self.app_id]['global'].get(self.pop(bytes), 0))
+        elif op == 'app_global_put':
+            value, key = self.pop(), self.pop(bytes)
+            self.ledger.apps[self.app_id]['global'][key] = value
+        elif op == 'app_global_del':
+            self.ledger.apps[self.app_id]['global'].pop(self.pop(bytes), None)
+        elif op == 'app_global_get_ex':
+            key, app = self.pop(bytes), self.foreign_app(self.pop(int))
+            state = self.ledger.apps.get(app, {'global': {}})['global']
+            self.push(state.get(key, 0))
+            self.push(key in state)
+        elif op == 'app_local_get':
+            key, account = self.pop(bytes), self.pop()
+            self.push(self.local_state(account).get(key, 0))
+        elif op == 'app_local_put':
+            value, key, account = self.pop(), self.pop(bytes), self.pop()
+            self.local_state(account)[key] = value
+        elif op == 'app_local_del':
+            key, account = self.pop(bytes), self.pop()
+            self.local_state(account).pop(key, None)
+        else:
+            raise AVMError(f'unsupported opcode {op}')
+        return None
+
+# run $teal as an app call to $app_id; txn is group[txn_index]
+# the budget pool is shared with the other app calls of the group
+# ledger changes are rolled back when the program rejects or fails
+def run(teal, ledger, app_id, group, txn_index=None, budget=None):
+    program = teal if isinstance(teal, Program) else Program(teal)
+    if txn_index is None:
+        txn_index = len(group) - 1
+    txn = group[txn_index]
+    if budget is None:
+        budget = Budget(sum(1 for t in group if t.get('TypeEnum') in ('appl', int_constants['appl'])))
+    snapshot = ledger.snapshot()
+    on_completion = txn.get('OnCompletion', 0)
+    sender = address_bytes(txn['Sender'])
+    if on_completion == int_constants['OptIn']:
+        ledger.opt_in(sender, app_id)
+    ev = Eval(program, ledger, app_id, txn, group, budget)
+    try:
+        approved = ev.run() not in (0, b'')
+    except (AVMError, IndexError, KeyError) as e:
+        ledger.restore(snapshot)
+        if on_completion == int_constants['ClearState']:
+            ledger.locals.pop((sender, app_id), None)
+        return Result(False, ev.cost, ev.logs, ev.inner_txns, error=str(e) or type(e).__name__, error_hint=ev.last_bytes)
+    if not approved:
+        ledger.restore(snapshot)
+    if (approved and on_completion == int_constants['CloseOut']) or on_completion == int_constants['ClearState']:
+        # clear state removes local state even when the clear program fails
+        ledger.locals.pop((sender, app_id), None)
+    return Result(approved, ev.cost, ev.logs, ev.inner_txns, budget_checks=ev.budget_checks)
@@ -0,0 +1,315 @@
+import argparse
+import hashlib
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+
+from algosdk import encoding, logic
+
+import avm
+
+# Side by side report of the contracts at a git revision vs the working tree:
+# program size and opcode cost per method, measured on the avm.py model.
+# Every scenario is run against both builds and their outcomes (approval, logs,
+# inner transactions other than OpUp calls, resulting state) must match.
+# Both sides build for the deployed AVM targets unless --version is given for the working tree.
+#
+#   python tools/build_report.py [--base e557be2] [--version 8]
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(root, 'draw'))
+from assets import ticket_price, burn_ticket_price, storage_app_id, oracle_app_id, rewards_pool_address
+sys.path.pop(0)
+
+draw_app_id = 951618646
+creator = 'CUPSTAKEOXXAYC3AOAK7QG3A6776Z4TKLOGFYN6CKMR33BT6QLFBEPJY4U'
+executor = 'CUPSTAKEDBJH22LDXFP24GJP4Y2MB4IT7E7CFDFCEMJVJXHA3VCWNVOFVA'
+user = 'DTHIRTEENNLSYGLSEXTXC6X4SVDWMFRCPAOAUCXWIXJRCVBWIIGLYARNQE'
+draw_app_address = logic.get_application_address(draw_app_id)
+
+# approximate cost of the randomness beacon's get() - it runs on the shared budget pool
+oracle_cost = 250
+
+max_odds = 2**20
+teams = 32
+free_draw_nft_id = 777
+
+def team_nft_id(team):
+    return 1000 + team
+
+# storage contract layout: key i (as itob) -> team NFT ID (odd) / cumulative odds (even), equal odds
+def storage_state():
+    state = {}
+    for team in range(1, teams + 1):
+        state[avm.itob(2 * team - 1)] = team_nft_id(team)
+        state[avm.itob(2 * team)] = team * max_odds // teams
+    return state
+
+# 256 bit randomness whose value modulo max_odds lands on $team
+def rand_for_team(team):
+    high = int.from_bytes(hashlib.sha256(b'cupstakes').digest(), 'big') & ~(max_odds - 1)
+    return (high | ((team - 1) * max_odds // teams)).to_bytes(32, 'big')
+
+contract_files = ('draw/sc.py', 'draw/assets.py', 'storage/sc.py')
+
+# load <source>/<name>/sc.py as a fresh module - subroutines are cached per build
+# version None builds the deployed target
+def load_contract(name, version=None, source=root):
+    path = os.path.join(source, name, 'sc.py')
+    spec = importlib.util.spec_from_file_location(f'{name}_sc', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(path))
+    # assets is imported by draw/sc.py - make sure it comes from the same source tree
+    assets = sys.modules.pop('assets', None)
+    try:
+        spec.loader.exec_module(module)
+        return module.get_contracts() if version is None else module.get_contracts(version=version)
+    finally:
+        sys.path.pop(0)
+        sys.modules.pop('assets', None)
+        if assets is not None:
+            sys.modules['assets'] = assets
+
+# both contracts as of git revision $rev, built for their deployed targets
+def load_revision(rev):
+    with tempfile.TemporaryDirectory() as source:
+        for path in contract_files:
+            os.makedirs(os.path.join(source, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(source, path), 'wb') as f:
+                f.write(subprocess.run(['git', 'show', f'{rev}:{path}'], cwd=root, check=True, capture_output=True).stdout)
+        return {'draw': load_contract('draw', source=source), 'storage': load_contract('storage', source=source)}
+
+def abi_arg(arg):
+    if isinstance(arg, int):
+        return avm.itob(arg)
+    return len(arg).to_bytes(2, 'big') + arg
+
+# ARC-4: arguments past the 14th are packed into a tuple in the last app arg
+def abi_tuple(args):
+    head_size = sum(8 if isinstance(a, int) else 2 for a in args)
+    head, tail = b'', b''
+    for arg in args:
+        if isinstance(arg, int):
+            head += abi_arg(arg)
+        else:
+            head += (head_size + len(tail)).to_bytes(2, 'big')
+            tail += abi_arg(arg)
+    return head + tail
+
+def app_call(sender, app_id, method=None, args=(), accounts=(), assets=(), apps=(), on_completion=0):
+    app_args = []
+    if method is not None:
+        app_args = [avm.method_selector(method)] + [abi_arg(a) for a in args[:14]]
+        if len(args) == 15:
+            app_args.append(abi_arg(args[14]))
+        elif len(args) > 15:
+            app_args.append(abi_tuple(args[14:]))
+    return {
+        'TypeEnum': 'appl', 'Sender': sender, 'ApplicationID': app_id, 'OnCompletion': on_completion,
+        'ApplicationArgs': app_args, 'Accounts': list(accounts), 'Assets': list(assets), 'Applications': list(apps),
+    }
+
+def payment(sender, amount, receiver=rewards_pool_address):
+    return {'TypeEnum': 'pay', 'Sender': sender, 'Receiver': receiver, 'Amount': amount}
+
+def local(**values):
+    state = {b'slot1': 0, b'slot2': 0, b'slot3': 0, b'draw_round': 0, b'draw_amount': 0, b'draw_amount_paid': 0}
+    state.update({k.encode(): v for k, v in values.items()})
+    return state
+
+# scenarios: name -> (setup(ledger), group); the app call is the last txn of the group
+# exhaustive: also draw every team with 1x/2x/3x draws - compared but left out of the cost table
+def draw_scenarios(exhaustive=False):
+    queued = lambda amount, rnd=1000: local(draw_round=rnd, draw_amount=amount, draw_amount_paid=amount * ticket_price)
+    full = local(slot1=team_nft_id(1), slot2=team_nft_id(2), slot3=team_nft_id(3))
+
+    def user_state(state, rand_team=None, round=None):
+        def setup(ledger):
+            ledger.opt_in(user, draw_app_id, state)
+            if rand_team is not None:
+                ledger.rand = rand_for_team(rand_team)
+            if round is not None:
+                ledger.round = round
+        return setup
+
+    # exec_draw calls the oracle and reads/OpUps the storage contract: both must be foreign apps
+    def exec_draw():
+        return app_call(executor, draw_app_id, 'exec_draw()void', accounts=[user], apps=[oracle_app_id, storage_app_id])
+
+    empty = user_state(local())
+    scenarios = {
+        'opt_in': (lambda ledger: None, [app_call(user, draw_app_id, on_completion=1)]),
+        'draw': (empty, [payment(user, ticket_price), app_call(user, draw_app_id, 'draw()uint64')]),
+        'draw3': (empty, [payment(user, 3 * ticket_price), app_call(user, draw_app_id, 'draw3()uint64')]),
+        'free_draw': (empty, [
+            {'TypeEnum': 'axfer', 'Sender': user, 'XferAsset': free_draw_nft_id, 'AssetAmount': 1, 'AssetReceiver': draw_app_address},
+            app_call(user, draw_app_id, 'free_draw()uint64'),
+        ]),
+        'burn_draw': (user_state(local(slot1=team_nft_id(1))), [
+            payment(user, burn_ticket_price), app_call(user, draw_app_id, 'burn_draw(uint64)uint64', [1]),
+        ]),
+        'burn_draw2': (user_state(local(slot1=team_nft_id(1), slot2=team_nft_id(2))), [
+            payment(user, 2 * burn_ticket_price), app_call(user, draw_app_id, 'burn_draw2(uint64,uint64)uint64', [1, 2]),
+        ]),
+        'burn_draw3': (user_state(full), [
+            payment(user, 3 * burn_ticket_price), app_call(user, draw_app_id, 'burn_draw3()uint64'),
+        ]),
+        'exec_draw 1x first team': (user_state(queued(1), 1, 1002), [exec_draw()]),
+        'exec_draw 1x last team': (user_state(queued(1), teams, 1002), [exec_draw()]),
+        'exec_draw 3x first team': (user_state(queued(3), 1, 1002), [exec_draw()]),
+        'exec_draw 3x last team': (user_state(queued(3), teams, 1002), [exec_draw()]),
+        'collect': (user_state(full), [app_call(user, draw_app_id, 'collect()void')]),
+        'refund': (user_state(queued(3), round=2001), [app_call(executor, draw_app_id, 'refund()uint64', accounts=[user])]),
+        'close_out': (user_state(full), [app_call(user, draw_app_id, on_completion=2)]),
+        'clear_state': (user_state(full), [app_call(user, draw_app_id, on_completion=3)]),
+        'update_state_int': (lambda ledger: None, [app_call(creator, draw_app_id, 'update_state_int(byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64)void',
+                                                            [b'ticket', ticket_price] + [b'', 0] * 7)]),
+        'get_free_draw_nft': (lambda ledger: None, [payment(creator, 2 * ticket_price), app_call(creator, draw_app_id, 'get_free_draw_nft(uint64)void', [2])]),
+        'optin': (lambda ledger: None, [app_call(creator, draw_app_id, 'optin()void', assets=[team_nft_id(1), team_nft_id(2)])]),
+        'closeout_nft': (lambda ledger: None, [app_call(creator, draw_app_id, 'closeout_nft()void', assets=[team_nft_id(1), team_nft_id(2)])]),
+        'odds_hash': (lambda ledger: None, [app_call(user, draw_app_id, 'odds_hash()byte[32]', apps=[storage_app_id])]),
+        # failure paths must fail the same way (same error string) on both builds
+        'exec_draw too early': (user_state(queued(1, 1008), 1, 1002), [exec_draw()]),
+        'draw3 must collect': (user_state(local(slot2=team_nft_id(2))), [payment(user, 3 * ticket_price), app_call(user, draw_app_id, 'draw3()uint64')]),
+        'burn_draw2 same slot': (user_state(full), [payment(user, 2 * burn_ticket_price), app_call(user, draw_app_id, 'burn_draw2(uint64,uint64)uint64', [1, 1])]),
+    }
+    if exhaustive:
+        for amount in range(1, 4):
+            for team in range(1, teams + 1):
+                scenarios[f'exhaustive exec_draw {amount}x team {team}'] = (
+                    user_state(queued(amount), team, 1002), [exec_draw()]
+                )
+    return scenarios
+
+def storage_scenarios():
+    args = []
+    for i in range(1, 9):
+        args += [avm.itob(i), team_nft_id(i)]
+    return {
+        'opup (bare no_op)': (lambda ledger: None, [app_call(draw_app_address, storage_app_id)]),
+        'update_state_int': (lambda ledger: None, [app_call(creator, storage_app_id, 'update_state_int(byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64,byte[],uint64)void', args)]),
+    }
+
+# a ledger with both contracts created through their programs, and the oracle mocked
+def new_ledger(draw_teal, storage_teal):
+    ledger = avm.Ledger(round=1000)
+    ledger.rand = rand_for_team(1)
+    ledger.create_app(storage_app_id, creator)
+    ledger.create_app(draw_app_id, creator)
+    for app_id, teal in ((storage_app_id, storage_teal), (draw_app_id, draw_teal)):
+        # a failed creation shows up as different outcomes of every scenario
+        avm.run(teal, ledger, app_id, [app_call(creator, 0)])
+    ledger.apps[storage_app_id]['global'].update(storage_state())
+    ledger.apps[draw_app_id]['global'][b'free_draw_nft'] = free_draw_nft_id
+
+    def oracle(ledger, itxn, budget):
+        budget.spend(oracle_cost)
+        return [bytes.fromhex('151f7c75') + abi_arg(ledger.rand)]
+
+    def storage(ledger, itxn, budget):
+        itxn = dict(itxn, Sender=encoding.decode_address(draw_app_address))
+        return avm.run(storage_teal, ledger, storage_app_id, [itxn], budget=budget).logs
+
+    ledger.handlers[oracle_app_id] = oracle
+    ledger.handlers[storage_app_id] = storage
+    return ledger
+
+def run_scenario(teal, ledger, app_id, setup, group):
+    setup(ledger)
+    result = avm.run(teal, ledger, app_id, group)
+    opups = [t for t in result.inner_txns if t.get('ApplicationID') == storage_app_id and t.get('TypeEnum') == avm.int_constants['appl']]
+    others = [t for t in result.inner_txns if not any(t is o for o in opups)]
+    # custom_assert error strings are part of the outcome, other failures only by kind
+    error = (result.error, result.error_hint if result.error == 'assert failed' else None)
+    outcome = (result.approved, error if not result.approved else None, result.logs, others, ledger.snapshot())
+    return result, len(opups), outcome
+
+def table(rows, header):
+    widths = [max(len(str(r[i])) for r in rows + [header]) for i in range(len(header))]
+    line = lambda r: '| ' + ' | '.join(str(c).ljust(w) for c, w in zip(r, widths)) + ' |'
+    return '\n'.join([line(header), '| ' + ' | '.join('-' * w for w in widths) + ' |'] + [line(r) for r in rows])
+
+# run all scenarios on two builds and report size, cost and any difference in outcome
+# builds: {'draw': get_contracts() output, 'storage': get_contracts() output}
+# returns (report text, whether all outcomes matched)
+def compare(old, new, old_label, new_label, exhaustive=False):
+    mismatches = []
+    out = []
+    # (label, checked cost) -> (most ops run after that check, scenario)
+    budget_checks = {}
+
+    size_rows = []
+    for name in ('draw', 'storage'):
+        for program, idx in (('approval', 0), ('clear', 1)):
+            size_rows.append([
+                f'{name} {program}',
+                f'{avm.Program(old[name][idx]).op_count()} / {avm.Program(new[name][idx]).op_count()}',
+                f'{avm.assembled_size(old[name][idx])} / {avm.assembled_size(new[name][idx])}',
+            ])
+    out.append(f'## Program size ({old_label} / {new_label})\n')
+    out.append(table(size_rows, ['program', 'TEAL ops', 'est. bytes']))
+
+    for name, scenarios, app_id in (('draw', draw_scenarios(exhaustive), draw_app_id), ('storage', storage_scenarios(), storage_app_id)):
+        rows = []
+        for scenario, (setup, group) in scenarios.items():
+            clear = group[-1]['OnCompletion'] == avm.int_constants['ClearState']
+            results = []
+            for build in (old, new):
+                ledger = new_ledger(build['draw'][0], build['storage'][0])
+                results.append(run_scenario(build[name][1 if clear else 0], ledger, app_id, setup, group))
+            (old_result, old_opups, old_outcome), (new_result, new_opups, new_outcome) = results
+            for label, (result, _, _) in zip((old_label, new_label), results):
+                for checked, ops in result.budget_checks:
+                    worst = budget_checks.get((label, checked))
+                    if worst is None or ops > worst[0]:
+                        budget_checks[(label, checked)] = (ops, f'{name}: {scenario}')
+            if old_outcome != new_outcome:
+                mismatches.append(f'{name}: {scenario}')
+            if exhaustive and 'exhaustive' in scenario:
+                continue
+            if old_result.approved:
+                status = 'ok'
+            elif old_result.error == 'assert failed':
+                status = f'rejected: {(old_result.error_hint or b"").decode(errors="replace")}'
+            else:
+                status = f'rejected: {old_result.error}'
+            rows.append([scenario, status, old_result.cost, new_result.cost, old_result.cost - new_result.cost, f'{old_opups} / {new_opups}'])
+        out.append(f'\n## {name} cost per call ({old_label} / {new_label})\n')
+        out.append(table(rows, ['scenario', 'outcome', old_label, new_label, 'saved', 'OpUps']))
+
+    # ensure_budget(C) promises C ops until the next check: the measured worst case must fit
+    short = []
+    if budget_checks:
+        rows = []
+        for (label, checked), (ops, scenario) in sorted(budget_checks.items()):
+            rows.append([label, checked, ops, scenario, 'ok' if ops <= checked else 'TOO LOW'])
+            if ops > checked:
+                short.append(f'{label} ensure_budget({checked})')
+        out.append(f'\n## Budget checks (worst case ops until the next check)\n')
+        out.append(table(rows, ['build', 'checked', 'measured', 'scenario', 'status']))
+
+    out.append('')
+    if mismatches:
+        out.append('OUTCOME MISMATCH between builds: ' + ', '.join(mismatches))
+    else:
+        out.append('All scenarios behave identically on both builds.')
+    if short:
+        out.append('BUDGET CHECK TOO LOW: ' + ', '.join(short))
+    return '\n'.join(out), not mismatches and not short
+
+def report(base, version=None):
+    old = load_revision(base)
+    new = {'draw': load_contract('draw', version), 'storage': load_contract('storage', version)}
+    return compare(old, new, base, 'tree' if version is None else f'tree v{version}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare size & per-method cost of the contracts at a git revision vs the working tree')
+    parser.add_argument('--base', default='HEAD', help='git revision to compare against (default HEAD)')
+    parser.add_argument('--version', type=int, default=None, help='AVM version to build the working tree for (default: deployed targets)')
+    args = parser.parse_args()
+    text, ok = report(args.base, args.version)
+    print(text)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,147 @@
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import math
+from fractions import Fraction
+
+# Offline odds table builder
+#
+# Turns real valued team probabilities into the integer odds table of the storage contract:
+# 1: TEAM_1_NFT_ID
+# 2: TEAM_1_ODDS
+# 3: TEAM_2_NFT_ID
+# 4: TEAM_2_ODDS + TEAM_1_ODDS
+# ...
+# 2n: SUM(TEAM_ODDS) == max_odds **MUST BE POWER OF 2**
+#
+# Each team gets an integer share of max_odds that minimizes the total absolute deviation
+# from its exact share (largest remainder), with at least 1 so every team stays drawable.
+# Shares are computed in exact integer arithmetic. The table comes with a sha256 content hash
+# that the draw contract's odds_hash() method reproduces on-chain from the storage contract.
+#
+#   python tools/odds.py teams.csv --bits 20 --bits 24
+#
+# teams.csv columns: name, nft_id, probability (weights, need not sum to 1)
+
+# team capacity of the storage contract: 64 keys, all of them covered by odds_hash()
+team_slots = 32
+# max_odds must fit in a uint64
+max_bits = 63
+
+def itob(n):
+    return n.to_bytes(8, 'big')
+
+def read_teams(path):
+    with open(path, newline='') as f:
+        return [(row['name'], int(row['nft_id']), Fraction(row['probability'])) for row in csv.DictReader(f)]
+
+# integer allocation of max_odds proportional to $weights, every team >= 1
+# minimizes sum(|odds_i - exact_i|): floors first, then the remainder goes to the largest fractions;
+# if the minimum of 1 overshoots, take back from the largest teams (every unit taken costs the same)
+# weights are scaled to integers, so exact_i = ints_i * max_odds / total is compared by its numerator
+def allocate(weights, max_odds):
+    if not weights:
+        raise ValueError('no teams')
+    if max_odds <= 0 or max_odds & (max_odds - 1) or max_odds > 2**max_bits:
+        raise ValueError(f'max_odds must be a power of 2 up to 2**{max_bits}, got {max_odds}')
+    if len(weights) > max_odds:
+        raise ValueError(f'{len(weights)} teams do not fit in max_odds {max_odds}')
+    if any(w <= 0 for w in weights):
+        raise ValueError('team probabilities must be positive')
+    ratios = [w.as_integer_ratio() for w in weights]
+    scale = math.lcm(*(d for _, d in ratios))
+    ints = [n * (scale // d) for n, d in ratios]
+    total = sum(ints)
+    odds = [max(1, w * max_odds // total) for w in ints]
+    remainder = max_odds - sum(odds)
+    if remainder > 0:
+        by_fraction = heapq.nlargest(remainder, range(len(odds)), key=lambda i: ints[i] * max_odds - odds[i] * total)
+        for i in by_fraction:
+            odds[i] += 1
+    elif remainder < 0:
+        largest = [(-ints[i], i) for i in range(len(odds)) if odds[i] > 1]
+        heapq.heapify(largest)
+        for _ in range(-remainder):
+            neg_weight, i = heapq.heappop(largest)
+            odds[i] -= 1
+            if odds[i] > 1:
+                heapq.heappush(largest, (neg_weight, i))
+    if sum(odds) != max_odds:
+        raise ValueError(f'odds sum to {sum(odds)} instead of max_odds {max_odds}')
+    return odds
+
+# sum of |odds_i / max_odds - p_i| over all teams, in probability terms
+def total_deviation(weights, odds, max_odds):
+    weights = [Fraction(w) for w in weights]
+    total = sum(weights)
+    return float(sum(abs(Fraction(o, max_odds) - w / total) for w, o in zip(weights, odds)))
+
+# storage contract state: key number -> value; unused slots are zeroed
+# nft IDs must be non zero (get_random_nft_id fails on 0) and unique
+def layout(nft_ids, odds):
+    if len(nft_ids) > team_slots:
+        raise ValueError(f'{len(nft_ids)} teams do not fit in the {team_slots} team slots')
+    if 0 in nft_ids:
+        raise ValueError('nft_id 0 is not a valid team NFT')
+    duplicates = sorted({nft_id for nft_id in nft_ids if nft_ids.count(nft_id) > 1})
+    if duplicates:
+        raise ValueError(f'duplicate nft_ids: {", ".join(map(str, duplicates))}')
+    state = {}
+    cumulative = 0
+    for team in range(team_slots):
+        if team < len(nft_ids):
+            cumulative += odds[team]
+            state[2 * team + 1] = nft_ids[team]
+            state[2 * team + 2] = cumulative
+        else:
+            state[2 * team + 1] = 0
+            state[2 * team + 2] = 0
+    return state
+
+# sha256 over all values as 8 byte big endian, in key order - same as the draw contract's odds_hash()
+def content_hash(state):
+    return hashlib.sha256(b''.join(itob(state[key]) for key in sorted(state))).hexdigest()
+
+# update_state_int takes 8 [key, value] pairs per call
+def update_batches(state, per_call=8):
+    items = [[itob(key).hex(), value] for key, value in sorted(state.items())]
+    return [items[i:i + per_call] for i in range(0, len(items), per_call)]
+
+def build(teams, max_odds):
+    weights = [p for _, _, p in teams]
+    odds = allocate(weights, max_odds)
+    state = layout([nft_id for _, nft_id, _ in teams], odds)
+    return {
+        'max_odds': max_odds,
+        'total_deviation': total_deviation(weights, odds, max_odds),
+        'hash': content_hash(state),
+        'teams': [{'name': name, 'nft_id': nft_id, 'odds': o} for (name, nft_id, _), o in zip(teams, odds)],
+        'state': {str(key): value for key, value in sorted(state.items())},
+        'update_state_int': update_batches(state),
+    }
+
+def bits_arg(value):
+    bits = int(value)
+    if not 1 <= bits <= max_bits:
+        raise argparse.ArgumentTypeError(f'must be in 1..{max_bits} (max_odds = 2**bits must fit in a uint64)')
+    return bits
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the storage contract odds table from team probabilities')
+    parser.add_argument('teams', help='CSV with name, nft_id, probability columns')
+    parser.add_argument('--bits', type=bits_arg, action='append', help='max_odds = 2**bits, repeat to compare (default 20)')
+    parser.add_argument('--out', help='write the table for the first --bits to this JSON file')
+    args = parser.parse_args()
+
+    teams = read_teams(args.teams)
+    try:
+        tables = [build(teams, 2**bits) for bits in (args.bits or [20])]
+    except ValueError as e:
+        parser.error(str(e))
+    for bits, table in zip(args.bits or [20], tables):
+        print(f'2**{bits:<3} max_odds {table["max_odds"]:<12} total deviation {table["total_deviation"]:.3e}  hash {table["hash"]}')
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(tables[0], f, indent=2)
@@ -0,0 +1,258 @@
+import argparse
+import sys
+
+import avm
+import build_report
+
+# Peephole optimizer for router-compiled TEAL
+#
+# A post-compile stage on the output of get_contracts():
+#
+#   from peephole import optimize_contracts
+#   approval, clear, contract = optimize_contracts(get_contracts())
+#
+# Passes, repeated until nothing changes:
+# - constant branches: `int 1; bnz L` -> `b L` (pyteal's Cond default), `int 1; bz L` -> nothing
+# - negated branches: `!; bnz L` -> `bz L` and vice versa
+# - zero compares: `int 0; ==` -> `!`, `int 0; !=` before a branch/assert -> nothing
+# - jump threading, jumps to the next op, unreachable code and unused labels
+# - store/load pairs of scratch slots that are never loaded anywhere else
+#
+# Constants are left as `int`/`byte`: goal's assembler already moves repeated ones into
+# intcblock/bytecblock. Repeated state reads are left too: keeping one in a scratch slot
+# (`dup; store` + `load`) only pays off from the third local / fourth global read within
+# straight line code, which neither contract has.
+#
+# Custom assert error strings are left in place (`byte ""; byte "ERR"; ==; assert`) so algod
+# error messages still carry them for the frontend.
+#
+# Semantics are checked by differential execution on the avm.py model, running every
+# build_report.py scenario (and every team for 1x/2x/3x draws) on both programs:
+#
+#   python tools/peephole.py [--version 8]
+
+terminators = ('b', 'err', 'return', 'retsub')
+branches = ('b', 'bz', 'bnz', 'callsub')
+# multi target branches (AVM 8): the passes don't track their labels, and avm.py can't run them to check
+unsupported = ('switch', 'match')
+
+# program is a list of lines: ('op', name, args) | ('label', name) | ('comment', text)
+def parse(teal):
+    header = []
+    lines = []
+    for raw in teal.splitlines():
+        stripped = raw.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('#pragma'):
+            header.append(stripped)
+            continue
+        if stripped.startswith('//'):
+            lines.append(('comment', stripped))
+            continue
+        tokens = avm.tokenize(stripped)
+        if len(tokens) == 1 and tokens[0].endswith(':'):
+            lines.append(('label', tokens[0][:-1]))
+        else:
+            lines.append(('op', tokens[0], tokens[1:]))
+    return header, lines
+
+def render(header, lines):
+    out = list(header)
+    for line in lines:
+        if line[0] == 'op':
+            out.append(' '.join([line[1]] + list(line[2])))
+        elif line[0] == 'label':
+            out.append(line[1] + ':')
+        else:
+            out.append(line[1])
+    return '\n'.join(out)
+
+def is_op(line, *names):
+    return line[0] == 'op' and (not names or line[1] in names)
+
+def int_value(line):
+    if is_op(line, 'int'):
+        return avm.parse_int(line[2][0])
+    return None
+
+# index of the next op at or after i, skipping comments only (labels stop the search)
+def next_op(lines, i):
+    while i < len(lines) and lines[i][0] == 'comment':
+        i += 1
+    return i if i < len(lines) and lines[i][0] == 'op' else None
+
+# rewrite ops pairwise; fn(a, b) returns replacement lines for [a, b] or None to keep them
+def rewrite_pairs(lines, fn):
+    out = []
+    changed = False
+    i = 0
+    while i < len(lines):
+        j = next_op(lines, i + 1) if lines[i][0] == 'op' else None
+        if j is not None:
+            replacement = fn(lines[i], lines[j])
+            if replacement is not None:
+                out += lines[i + 1:j] + replacement
+                i = j + 1
+                changed = True
+                continue
+        out.append(lines[i])
+        i += 1
+    return out, changed
+
+def constant_branches(a, b):
+    value = int_value(a)
+    if value is None or not is_op(b, 'bz', 'bnz'):
+        return None
+    if (value != 0) == (b[1] == 'bnz'):
+        return [('op', 'b', b[2])]
+    return []
+
+def negated_branches(a, b):
+    if is_op(a, '!') and is_op(b, 'bz', 'bnz'):
+        return [('op', 'bnz' if b[1] == 'bz' else 'bz', b[2])]
+    return None
+
+def zero_compares(a, b):
+    if int_value(a) == 0 and is_op(b, '=='):
+        return [('op', '!', [])]
+    return None
+
+# `x; int 0; !=` followed by bz/bnz/assert only tests x for zero - the branch does that already
+def zero_tests(lines):
+    out = []
+    changed = False
+    i = 0
+    while i < len(lines):
+        j = next_op(lines, i + 1) if int_value(lines[i]) == 0 else None
+        k = next_op(lines, j + 1) if j is not None and is_op(lines[j], '!=') else None
+        if k is not None and is_op(lines[k], 'bz', 'bnz', 'assert'):
+            out += lines[i + 1:j] + lines[j + 1:k]
+            i = k
+            changed = True
+            continue
+        out.append(lines[i])
+        i += 1
+    return out, changed
+
+def label_targets(lines):
+    return {line[2][0] for line in lines if is_op(line, *branches)}
+
+# retarget jumps to labels that immediately jump elsewhere
+def thread_jumps(lines):
+    forward = {}
+    for i, line in enumerate(lines):
+        if line[0] == 'label':
+            j = i + 1
+            while j < len(lines) and lines[j][0] != 'op':
+                j += 1
+            if j < len(lines) and is_op(lines[j], 'b'):
+                forward[line[1]] = lines[j][2][0]
+    changed = False
+    out = []
+    for line in lines:
+        if is_op(line, 'b', 'bz', 'bnz'):
+            target = line[2][0]
+            seen = {target}
+            while target in forward and forward[target] not in seen:
+                target = forward[target]
+                seen.add(target)
+            if target != line[2][0]:
+                line = ('op', line[1], [target])
+                changed = True
+        out.append(line)
+    return out, changed
+
+# `b L` directly followed by `L:`
+def jumps_to_next(lines):
+    out = []
+    changed = False
+    for i, line in enumerate(lines):
+        if is_op(line, 'b'):
+            j = i + 1
+            following = set()
+            while j < len(lines) and lines[j][0] != 'op':
+                if lines[j][0] == 'label':
+                    following.add(lines[j][1])
+                j += 1
+            if line[2][0] in following:
+                changed = True
+                continue
+        out.append(line)
+    return out, changed
+
+# ops after an unconditional terminator and before the next label never run
+def unreachable(lines):
+    out = []
+    changed = False
+    dead = False
+    for line in lines:
+        if line[0] == 'label':
+            dead = False
+        elif dead and line[0] == 'op':
+            changed = True
+            continue
+        out.append(line)
+        if is_op(line, *terminators):
+            dead = True
+    return out, changed
+
+def unused_labels(lines):
+    targets = label_targets(lines)
+    out = [line for line in lines if line[0] != 'label' or line[1] in targets]
+    return out, len(out) != len(lines)
+
+def scratch_loads(lines):
+    counts = {}
+    for line in lines:
+        if is_op(line, 'load'):
+            counts[line[2][0]] = counts.get(line[2][0], 0) + 1
+    return counts
+
+# `store X; load X` where that is the only load of X: the value can stay on the stack
+def store_load_pairs(lines):
+    if any(is_op(line, 'loads', 'stores') for line in lines):
+        return lines, False
+    loads = scratch_loads(lines)
+
+    def pair(a, b):
+        if is_op(a, 'store') and is_op(b, 'load') and a[2] == b[2] and loads[b[2][0]] == 1:
+            return []
+        return None
+    return rewrite_pairs(lines, pair)
+
+local_passes = (constant_branches, negated_branches, zero_compares)
+global_passes = (zero_tests, thread_jumps, jumps_to_next, unreachable, unused_labels, store_load_pairs)
+
+def optimize(teal):
+    header, lines = parse(teal)
+    found = sorted({line[1] for line in lines if is_op(line, *unsupported)})
+    if found:
+        raise ValueError(f'cannot optimize programs using {", ".join(found)}')
+    changed = True
+    while changed:
+        changed = False
+        for fn in local_passes:
+            lines, c = rewrite_pairs(lines, fn)
+            changed |= c
+        for fn in global_passes:
+            lines, c = fn(lines)
+            changed |= c
+    return render(header, lines) + '\n'
+
+def optimize_contracts(contracts):
+    approval, clear, contract = contracts
+    return optimize(approval), optimize(clear), contract
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Peephole optimize the contracts and check them by differential execution')
+    parser.add_argument('--version', type=int, default=None, help='AVM version to build (default: deployed versions)')
+    args = parser.parse_args()
+    old = {
+        'draw': build_report.load_contract('draw', args.version),
+        'storage': build_report.load_contract('storage', args.version),
+    }
+    new = {name: optimize_contracts(contracts) for name, contracts in old.items()}
+    text, ok = build_report.compare(old, new, 'pyteal', 'peephole', exhaustive=True)
+    print(text)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,58 @@
+from fractions import Fraction
+
+import pytest
+
+import avm
+import build_report
+import odds
+
+@pytest.mark.parametrize('weights, bits', [
+    ([1], 0),
+    ([0.5, 0.3, 0.2], 20),
+    ([1, 1, 1], 63),
+    ([Fraction(1, 3), Fraction(2, 3)], 4),
+    ([i + 0.5 for i in range(32)], 10),
+    ([1e-9] * 31 + [1], 5),
+])
+def test_allocate_sums_to_max_odds_with_every_team_drawable(weights, bits):
+    result = odds.allocate(weights, 2**bits)
+    assert sum(result) == 2**bits
+    assert min(result) >= 1
+
+# exact shares 3.88, 0.06, 0.06: flooring and the minimum of 1 give 3 + 1 + 1 = 5 > 4,
+# the unit is taken back from the largest team
+def test_allocate_overshoot_takes_from_largest():
+    assert odds.allocate([100, 1.5, 1.5], 4) == [2, 1, 1]
+
+def test_allocate_largest_remainder():
+    assert odds.allocate([1, 2], 16) == [5, 11]
+    assert odds.allocate([Fraction(1, 3), Fraction(2, 3)], 16) == [5, 11]
+
+@pytest.mark.parametrize('max_odds', [0, 3, 12, 2**64])
+def test_allocate_rejects_invalid_max_odds(max_odds):
+    with pytest.raises(ValueError):
+        odds.allocate([1, 1], max_odds)
+
+@pytest.mark.parametrize('weights, max_odds', [([], 16), ([1, 0], 16), ([1, 1, 1], 2)])
+def test_allocate_rejects_invalid_teams(weights, max_odds):
+    with pytest.raises(ValueError):
+        odds.allocate(weights, max_odds)
+
+@pytest.mark.parametrize('nft_ids', [[1, 0], [5, 6, 5], list(range(1, 34))])
+def test_layout_rejects_invalid_nft_ids(nft_ids):
+    with pytest.raises(ValueError):
+        odds.layout(nft_ids, [1] * len(nft_ids))
+
+def test_content_hash_matches_odds_hash():
+    teams = [(f'team {i}', build_report.team_nft_id(i), Fraction(i, 100)) for i in range(1, 21)]
+    table = odds.build(teams, 2**20)
+
+    draw = build_report.load_contract('draw')
+    storage = build_report.load_contract('storage')
+    ledger = build_report.new_ledger(draw[0], storage[0])
+    ledger.apps[build_report.storage_app_id]['global'] = {avm.itob(int(key)): value for key, value in table['state'].items()}
+    _, group = build_report.draw_scenarios()['odds_hash']
+    result = avm.run(draw[0], ledger, build_report.draw_app_id, group)
+    assert result.approved
+    # ABI return: 151f7c75 prefix + byte[32]
+    assert result.logs[-1][4:].hex() == table['hash']